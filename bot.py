@@ -1,73 +1,159 @@
 import yaml
 import httpx
 import os
+import re
 import sys
 import time
 import subprocess
 import sqlite3
 import socket
+import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from mcstatus.server import JavaServer
 from flask import Flask, Blueprint, request
+from waitress import serve
 from typing import List, Dict
 
 DATABASE_PATH = "data.db"
+# 合法的 Minecraft 玩家名与 QQ 号，不合法的输入直接拒绝，不再交给客户端
+USERNAME_RE = re.compile(r"^[A-Za-z0-9_]{3,16}\Z")
+QQ_RE = re.compile(r"^[1-9][0-9]{4,11}\Z")
+MCC_COMMAND = ["MinecraftClient.exe", "cons01e3MU", "-", "mc.bili33.top:10125"]
+# 添加白名单成功时服务器返回的内容；移除命令的回复内容未知，只要求回复里提到玩家名且没有报错
+MCC_ADD_SUCCESS = "已加入白名单"
+# 玩家聊天行，形如 "<player> ..."，前面可能带有时间戳之类的 [..] 前缀
+MCC_CHAT_RE = re.compile(r"^\s*(\[[^\]]*\]\s*)*<[^>]+>")
+MCC_LOCK = threading.Lock()
+MCC_OUTPUT = queue.Queue()
+# 只有在命令等待回复时才把输出放进 MCC_OUTPUT，空闲时的聊天等输出直接丢弃
+MCC_WAITING = threading.Event()
+# 服务器状态缓存 {地址: (过期时间, 查询结果)}
+SERVER_INFO_TTL = 5
+SERVER_INFO_CACHE = {}
+
+# SQL 语句统一定义为模块级常量，每次调用传入同一个字符串，直接命中 sqlite3 的语句缓存
+SQL_CREATE_BIND = """
+    CREATE TABLE IF NOT EXISTS bind (
+        qq TEXT PRIMARY KEY NOT NULL,
+        mc TEXT,
+        is_admin BOOLEAN NOT NULL DEFAULT FALSE,
+        ban BOOLEAN NOT NULL DEFAULT FALSE
+    )
+"""
+SQL_CREATE_INDEX_MC = "CREATE INDEX IF NOT EXISTS idx_bind_mc ON bind(mc) WHERE mc IS NOT NULL"
+SQL_CREATE_INDEX_BAN = "CREATE INDEX IF NOT EXISTS idx_bind_ban ON bind(ban) WHERE ban = TRUE"
+SQL_ADD_ADMINS = "INSERT OR REPLACE INTO bind (qq, is_admin) VALUES {}"
+SQL_ADD_BIND = "INSERT INTO bind (qq, mc) VALUES (?, ?) ON CONFLICT(qq) DO UPDATE SET mc=excluded.mc"
+SQL_REMOVE_BIND_QQ = "DELETE FROM bind WHERE qq = ?"
+SQL_REMOVE_BIND_MC = "DELETE FROM bind WHERE mc = ?"
+# 管理员的记录只清空 mc，普通玩家的记录直接删除；都要求 mc 与已移除白名单的玩家名一致
+SQL_UNBIND_ADMIN = "UPDATE bind SET mc = NULL WHERE qq = ? AND mc = ? AND is_admin RETURNING qq"
+SQL_UNBIND_QQ = "DELETE FROM bind WHERE qq = ? AND mc = ? AND NOT is_admin RETURNING qq"
+SQL_BAN_QQ = "UPDATE bind SET ban = TRUE WHERE qq = ?"
+SQL_BAN_MC = "UPDATE bind SET ban = TRUE WHERE mc = ?"
+SQL_COUNT_QQ = "SELECT COUNT(*) FROM bind WHERE qq = ?"
+SQL_COUNT_MC = "SELECT COUNT(*) FROM bind WHERE mc = ?"
+SQL_QUERY_USERNAME = "SELECT mc FROM bind WHERE qq = ?"
+SQL_QUERY_BAN = "SELECT 1 FROM bind WHERE (qq = ? OR mc = ?) AND ban = TRUE LIMIT 1"
+SQL_CHECK_BIND = "SELECT qq, mc, ban FROM bind WHERE qq = ? OR mc = ?"
 app = Flask(__name__)
 
 class ServerConnectionError(Exception):
     pass
 
+
+class SqlitePool:
+    """
+    SQLite 连接池：一个写连接 + 若干只读连接。
+    写操作通过锁串行执行，读操作可以在多个连接上并发执行。
+    """
+
+    def __init__(self, path: str, readers: int = 5):
+        # 写连接需要先打开并切换到 WAL 模式，只读连接才能与其并发
+        self.rw_conn = self._connect(path, isolation_level=None)
+        self.rw_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_lock = threading.Lock()
+        self._readers = queue.Queue()
+        for _ in range(readers):
+            # 只读方式打开，SQLite 会跳过写相关的准备工作；WAL 模式下读写互不阻塞
+            conn = self._connect(f"file:{path}?mode=ro", uri=True)
+            conn.execute("PRAGMA query_only=ON")
+            self._readers.put(conn)
+
+    @staticmethod
+    def _connect(database: str, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(database, check_same_thread=False, **kwargs)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=memory")
+        conn.execute("PRAGMA cache_size=-64000")
+        return conn
+
+    @contextmanager
+    def read(self):
+        """从只读连接池中借出一个连接，用完后归还"""
+        conn = self._readers.get()
+        try:
+            yield conn.cursor()
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self):
+        """获取写连接，同一时间只允许一个线程写入，整个代码块在同一个事务中执行"""
+        with self._write_lock:
+            cursor = self.rw_conn.cursor()
+            # 写连接关闭了自动事务，这里显式 BEGIN IMMEDIATE，一开始就拿到写锁，
+            # 避免事务中途从读锁升级为写锁时出现 database is locked
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+                cursor.execute("COMMIT")
+            except BaseException:
+                # COMMIT 本身失败时事务也还开着，必须回滚，否则之后的 BEGIN 都会失败
+                if self.rw_conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+
 def init_database(admin_list):
     """初始化数据库，确保 bind 表存在，并将 admin_list 中的 qq 设置为管理员"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    # 创建 bind 表
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS bind (
-            qq TEXT PRIMARY KEY NOT NULL,
-            mc TEXT,
-            is_admin BOOLEAN NOT NULL DEFAULT FALSE,
-            ban BOOLEAN NOT NULL DEFAULT FALSE
-        )
-    """
-    )
+    with POOL.write() as cursor:
+        # 创建 bind 表
+        cursor.execute(SQL_CREATE_BIND)
+
+        # mc 和 ban 的部分索引，管理员行的 mc 多为 NULL，未封禁的行也不需要索引
+        cursor.execute(SQL_CREATE_INDEX_MC)
+        cursor.execute(SQL_CREATE_INDEX_BAN)
 
     # 将 admin_list 中的 qq 设置为管理员
-    for qq in admin_list:
-        cursor.execute(
-            """
-            INSERT OR REPLACE INTO bind (qq, is_admin) VALUES (?, TRUE)
-        """,
-            (qq,),
-        )
+    bulk_upsert_admins(admin_list)
 
-    conn.commit()
-    conn.close()
+
+def bulk_upsert_admins(qqs):
+    """
+    用一条多行 INSERT OR REPLACE 批量写入管理员，只解析、提交一次。
+    :param qqs: 要设置为管理员的 qq 列表
+    """
+    qqs = list(qqs)
+    if not qqs:
+        return
+
+    values = ",".join(["(?, TRUE)"] * len(qqs))
+    with POOL.write() as cursor:
+        cursor.execute(SQL_ADD_ADMINS.format(values), qqs)
 
 
 def add_bind(qq, mc):
     """添加绑定或更新现有绑定的 mc 值"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
     try:
         # 如果 qq 不存在则插入新行，否则更新 mc
-        cursor.execute(
-            """
-            INSERT INTO bind (qq, mc) VALUES (?, ?)
-            ON CONFLICT(qq) DO UPDATE SET mc=excluded.mc
-        """,
-            (qq, mc),
-        )
+        with POOL.write() as cursor:
+            cursor.execute(SQL_ADD_BIND, (qq, mc))
 
-        conn.commit()
         return True
     except sqlite3.Error:
-        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 
 def remove_bind(qq=None, mc=None):
@@ -80,64 +166,52 @@ def remove_bind(qq=None, mc=None):
     if not qq and not mc:
         raise ValueError("至少需要提供 qq 或 mc 进行删除")
 
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
     try:
-        if qq:
-            cursor.execute(
-                """
-                DELETE FROM bind WHERE qq = ?
-            """,
-                (qq,),
-            )
-        elif mc:
-            cursor.execute(
-                """
-                DELETE FROM bind WHERE mc = ?
-            """,
-                (mc,),
-            )
-
-        conn.commit()
-        return cursor.rowcount > 0
+        with POOL.write() as cursor:
+            if qq:
+                cursor.execute(SQL_REMOVE_BIND_QQ, (qq,))
+            elif mc:
+                cursor.execute(SQL_REMOVE_BIND_MC, (mc,))
+
+            return cursor.rowcount > 0
     except sqlite3.Error as e:
         print(f"删除操作时出错: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
+
+
+def unbind_qq(qq, mc):
+    """
+    解除指定 qq 与玩家名 mc 的绑定，用 RETURNING 确认是否有记录被修改（需要 SQLite 3.35+）。
+    管理员的记录只清空 mc，保留管理员身份；其他记录直接删除。
+    :param qq: 要解除绑定的 qq
+    :param mc: 当前绑定的玩家名，只有记录中的 mc 与之相同时才会解除
+    :return: 被解除绑定的 mc，没有匹配的记录时返回 None
+    """
+    try:
+        with POOL.write() as cursor:
+            # 用 fetchall 把语句执行完，避免写锁一直挂在未完成的语句上
+            rows = cursor.execute(SQL_UNBIND_ADMIN, (qq, mc)).fetchall()
+            rows += cursor.execute(SQL_UNBIND_QQ, (qq, mc)).fetchall()
+    except sqlite3.Error as e:
+        print(f"删除操作时出错: {e}")
+        return None
+
+    return mc if rows else None
 
 
 def ban_bind(qq=None, mc=None):
     """将指定 qq 或 mc 的记录标记为封禁"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
     try:
-        if qq:
-            cursor.execute(
-                """
-                UPDATE bind SET ban = TRUE WHERE qq = ?
-            """,
-                (qq,),
-            )
-
-        if mc:
-            cursor.execute(
-                """
-                UPDATE bind SET ban = TRUE WHERE mc = ?
-            """,
-                (mc,),
-            )
-
-        conn.commit()
-        return cursor.rowcount > 0
+        with POOL.write() as cursor:
+            if qq:
+                cursor.execute(SQL_BAN_QQ, (qq,))
+
+            if mc:
+                cursor.execute(SQL_BAN_MC, (mc,))
+
+            return cursor.rowcount > 0
     except sqlite3.Error:
-        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 
 def query_count(qq=None, mc=None):
@@ -147,34 +221,21 @@ def query_count(qq=None, mc=None):
     :param mc: 要查询的 mc (可选)
     :return: 匹配的数据条目数量
     """
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    if not qq and not mc:
+        raise ValueError("至少需要提供 qq 或 mc 进行查询")
 
     try:
-        if qq:
-            cursor.execute(
-                """
-                SELECT COUNT(*) FROM bind WHERE qq = ?
-            """,
-                (qq,),
-            )
-        elif mc:
-            cursor.execute(
-                """
-                SELECT COUNT(*) FROM bind WHERE mc = ?
-            """,
-                (mc,),
-            )
-        else:
-            raise ValueError("至少需要提供 qq 或 mc 进行查询")
+        with POOL.read() as cursor:
+            if qq:
+                cursor.execute(SQL_COUNT_QQ, (qq,))
+            else:
+                cursor.execute(SQL_COUNT_MC, (mc,))
 
-        count = cursor.fetchone()[0]
+            count = cursor.fetchone()[0]
         return count
     except sqlite3.Error as e:
         print(f"查询时出错: {e}")
         return 0
-    finally:
-        conn.close()
 
 def query_username(qq=None):
     """
@@ -182,24 +243,15 @@ def query_username(qq=None):
     :param qq: 要查询的 qq
     :return: qq号对应的玩家名
     """
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute(
-            """
-            SELECT mc FROM bind WHERE qq = ?
-        """,
-            (qq,),
-        )
+        with POOL.read() as cursor:
+            cursor.execute(SQL_QUERY_USERNAME, (qq,))
 
-        data = cursor.fetchone()[0]
-        return data
+            data = cursor.fetchone()
+        return data[0] if data else None
     except sqlite3.Error as e:
         print(f"查询时出错: {e}")
-        return 0
-    finally:
-        conn.close()
+        return None
 
 
 def force_edit_database(qq, mc):
@@ -208,72 +260,70 @@ def force_edit_database(qq, mc):
     :param qq: 要更新的 qq
     :param mc: 要更新的 mc
     """
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
     try:
         # 更新指定 qq 的 mc 值，或插入新记录
-        cursor.execute(
-            """
-            INSERT INTO bind (qq, mc)
-            VALUES (?, ?)
-            ON CONFLICT(qq) DO UPDATE SET mc=excluded.mc
-        """,
-            (qq, mc),
-        )
-
-        conn.commit()
+        with POOL.write() as cursor:
+            cursor.execute(SQL_ADD_BIND, (qq, mc))
     except sqlite3.Error as e:
         print(f"数据库操作时出错: {e}")
-    finally:
-        conn.close()
 
 
 def getMinecraftServerInfo(server_address: str) -> Dict:
-    for i in range(5):
+    last_err = ""
+    for attempt in range(3):
         try:
             server = JavaServer.lookup(server_address)
             status = server.status()
-            players = server.query().players.names
-            return {
-                "version": status.version.name,
-                "protocol_version": status.version.protocol,
-                "players": players,
-                "players_online": status.players.online,
-                "players_max": status.players.max,
-                "motd": status.description,
-                "latency": round(status.latency, 2),
-                "online": True,
-                "error": False,
-                "msg": "success"
-            }
-        except (TimeoutError, socket.gaierror) as e:
-            return {
-        "version": "N/A",
-        "protocol_version": -1,
-        "players": [],
-        "players_online": -1,
-        "players_max": -1,
-        "motd": -1,
-        "latency": -1,
-        "online": False,
-        "error": True,
-        "msg": e
-    }
+            break
+        except (TimeoutError, socket.gaierror, ConnectionRefusedError) as e:
+            # 网络错误时退避重试，其他异常直接抛给调用方
+            last_err = str(e)
+            if attempt < 2:
+                time.sleep(0.2 * (2**attempt))
+    else:
+        return {
+            "version": "N/A",
+            "protocol_version": -1,
+            "players": [],
+            "players_online": -1,
+            "players_max": -1,
+            "motd": -1,
+            "latency": -1,
+            "online": False,
+            "error": True,
+            "msg": last_err
+        }
+
+    try:
+        players = server.query().players.names
+    except OSError:
+        # 服务器未开启 query 时改用 status 中的玩家示例列表，不影响在线状态
+        players = [player.name for player in status.players.sample or []]
     return {
-        "version": "N/A",
-        "protocol_version": -1,
-        "players": [],
-        "players_online": -1,
-        "players_max": -1,
-        "motd": -1,
-        "latency": -1,
-        "online": False,
+        "version": status.version.name,
+        "protocol_version": status.version.protocol,
+        "players": players,
+        "players_online": status.players.online,
+        "players_max": status.players.max,
+        "motd": status.description,
+        "latency": round(status.latency, 2),
+        "online": True,
         "error": False,
         "msg": "success"
     }
 
 
+def getCachedMinecraftServerInfo(server_address: str) -> Dict:
+    """带短时缓存的 getMinecraftServerInfo，短时间内重复的 /status 直接返回缓存结果"""
+    cached = SERVER_INFO_CACHE.get(server_address)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
+
+    info = getMinecraftServerInfo(server_address)
+    SERVER_INFO_CACHE[server_address] = (time.monotonic() + SERVER_INFO_TTL, info)
+    return info
+
+
 def query_ban(qq=None, mc=None):
     """
     检查指定 qq 或 mc 是否被封禁。
@@ -284,112 +334,144 @@ def query_ban(qq=None, mc=None):
     if not qq and not mc:
         raise ValueError("至少需要提供 qq 或 mc 进行查询")
 
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
     try:
-        query = ""
-        params = ()
-
-        if qq:
-            query += """
-                SELECT ban FROM bind WHERE qq = ?
-            """
-            params += (qq,)
-
-        if mc:
-            if query:
-                query += " UNION "
-            query += """
-                SELECT ban FROM bind WHERE mc = ?
-            """
-            params += (mc,)
-
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-
-        # 检查是否有任何结果的 ban 列为 True
-        for result in results:
-            if result[0]:  # result[0] 是 ban 列的值
-                return True
-
-        return False
+        # 未提供的参数为 NULL，qq = NULL / mc = NULL 永远不成立，无需拆成两条查询
+        with POOL.read() as cursor:
+            cursor.execute(SQL_QUERY_BAN, (qq, mc))
+            return cursor.fetchone() is not None
     except sqlite3.Error as e:
         print(f"查询时出错: {e}")
         return False
-    finally:
-        conn.close()
 
 
-def addWhitelist(username: str):
+def check_bind(qq, mc):
+    """
+    一次查询同时检查 qq 和 mc 的封禁与绑定情况。
+    :param qq: 要检查的 qq
+    :param mc: 要检查的 mc
+    :return: (qq_banned, mc_banned, qq_exists, mc_exists)
+    """
+    qq_banned = mc_banned = qq_exists = mc_exists = False
+
+    try:
+        with POOL.read() as cursor:
+            cursor.execute(SQL_CHECK_BIND, (qq, mc))
+            rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"查询时出错: {e}")
+        return qq_banned, mc_banned, qq_exists, mc_exists
+
+    # qq 列为 TEXT，传入的 qq 可能是 int，统一转成字符串比较
+    for row_qq, row_mc, ban in rows:
+        if row_qq == str(qq):
+            qq_exists = True
+            qq_banned = qq_banned or bool(ban)
+        if row_mc == mc:
+            mc_exists = True
+            mc_banned = mc_banned or bool(ban)
+
+    return qq_banned, mc_banned, qq_exists, mc_exists
+
+
+def startMinecraftClient():
+    """启动 Minecraft-Console-Client 并等待其登录服务器，之后的命令都复用这个进程"""
+    global MCC
     # 启动 Minecraft-Console-Client 并创建双向管道
-    process = subprocess.Popen(
-        ["MinecraftClient.exe", "cons01e3MU", "-", "mc.bili33.top:10125"],
+    MCC = subprocess.Popen(
+        MCC_COMMAND,
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
         text=True,
         encoding="utf8",
     )
+    # 后台线程持续读取输出，避免管道写满导致客户端阻塞
+    threading.Thread(target=readMinecraftClient, args=(MCC,), daemon=True).start()
 
     # 等待客户端启动
     time.sleep(3)
 
-    # 发送消息
-    process.stdin.write(f"!!awr add {username}\n")
-    process.stdin.write("/quit\n")
-    process.stdin.flush()
-    output_all = ""
-    # 读取并打印输出
+
+def readMinecraftClient(process: subprocess.Popen):
+    """命令等待回复期间，把客户端的输出逐行打印并放进 MCC_OUTPUT，直到进程关闭 stdout"""
     try:
-        while True:
-            output = process.stdout.readline()
-            output_all += output
-            if output == "":
-                break
-            print(output.strip())
+        for output in process.stdout:
+            # 空闲时的聊天和广播不打印也不保留，日志里只有白名单命令的输出
+            if MCC_WAITING.is_set():
+                print(output.strip())
+                MCC_OUTPUT.put(output)
     except Exception as e:
         print(f"读取输出时出错: {e}")
-    print(output_all)
-    # 等待进程结束
-    process.wait()
-    if not "服务器的Minecraft版本" in output_all:
-        raise ServerConnectionError("添加失败，请重试！")
 
 
-def removeWhitelist(username: str):
-    # 启动 Minecraft-Console-Client 并创建双向管道
-    process = subprocess.Popen(
-        ["MinecraftClient.exe", "cons01e3MU", "-", "mc.bili33.top:10125"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        encoding="utf8",
-    )
+def watchMinecraftClient(interval: float = 5):
+    """定期检查客户端进程，进程退出后自动重启"""
+    while True:
+        time.sleep(interval)
+        with MCC_LOCK:
+            if MCC.poll() is not None:
+                print("MinecraftClient 已退出，正在重启……")
+                startMinecraftClient()
 
-    # 等待客户端启动
-    time.sleep(3)
 
-    # 发送消息
-    process.stdin.write(f"!!awr remove {username}\n")
-    process.stdin.write("/quit\n")
-    process.stdin.flush()
-    output_all = ""
-    # 读取并打印输出
+def sendMinecraftClient(command: str, username: str, success: str = None, timeout: float = 10) -> bool:
+    """
+    向常驻的客户端发送一条命令，并等待输出中出现 success；
+    success 为 None 时，任何提到 username 且不含失败信息的回复都视为成功。
+    客户端一直在线，输出里混有聊天和其他广播，只认提到 username 的非聊天行。
+    :param command: 要发送的命令
+    :param username: 命令针对的玩家名
+    :param success: 表示命令执行成功的输出内容 (可选)
+    :param timeout: 等待结果的总秒数
+    :return: 是否在超时前读到了 success
+    :raises ServerConnectionError: 输出中出现了失败或错误信息
+    """
+    # 玩家名只由字母、数字、下划线组成，前后不能紧跟这些字符，避免 Steve 匹配到 Steve2
+    target = re.compile(rf"(?<![A-Za-z0-9_]){re.escape(username)}(?![A-Za-z0-9_])")
+    with MCC_LOCK:
+        # 丢弃上一条命令之后残留的输出
+        while not MCC_OUTPUT.empty():
+            MCC_OUTPUT.get_nowait()
+
+        MCC_WAITING.set()
+        try:
+            return waitMinecraftClient(command, target, success, timeout)
+        finally:
+            MCC_WAITING.clear()
+
+
+def waitMinecraftClient(command: str, target: re.Pattern, success: str, timeout: float) -> bool:
+    """发送命令并读取回复，参数含义见 sendMinecraftClient，调用方需持有 MCC_LOCK"""
     try:
-        while True:
-            output = process.stdout.readline()
-            output_all += output
-            if output == "":
-                break
-            print(output.strip())
-    except Exception as e:
-        print(f"读取输出时出错: {e}")
+        MCC.stdin.write(f"{command}\n")
+        MCC.stdin.flush()
+    except OSError as e:
+        print(f"发送命令时出错: {e}")
+        return False
+
+    # 读到成功或失败的输出就立即返回，不必等到超时
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            output = MCC_OUTPUT.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            break
+        if MCC_CHAT_RE.match(output) or not target.search(output):
+            continue
+        if "失败" in output or "error" in output.lower():
+            raise ServerConnectionError(output.strip())
+        if success is None or success in output:
+            return True
+    return False
+
 
-    # 等待进程结束
-    process.wait()
-    if not "服务器的Minecraft版本" in output_all:
+def addWhitelist(username: str):
+    if not sendMinecraftClient(f"!!awr add {username}", username, MCC_ADD_SUCCESS):
+        raise ServerConnectionError("添加失败，请重试！")
+
+
+def removeWhitelist(username: str):
+    if not sendMinecraftClient(f"!!awr remove {username}", username):
         raise ServerConnectionError("移除失败，请重试！")
 
 debugBlueprint = Blueprint("debug", __name__, url_prefix="/debug")
@@ -399,18 +481,19 @@ debugBlueprint = Blueprint("debug", __name__, url_prefix="/debug")
 def statusHandler(qid: int):
     global server
     msg = f"""[CQ:at,qq={qid}] ====== 服务器状态一览 ======"""
-    for serv in server:
+    # 并发查询所有服务器，总耗时取决于最慢的一台而不是所有服务器之和
+    addresses = [f"{serv.get('host')}:{serv.get('port')}" for serv in server]
+    with ThreadPoolExecutor(max_workers=max(len(server), 1)) as executor:
+        statuses = list(executor.map(getCachedMinecraftServerInfo, addresses))
+    for serv, status in zip(server, statuses):
         name = serv.get("name")
-        host = serv.get("host")
-        port = serv.get("port")
-        status = getMinecraftServerInfo(f"{host}:{port}")
         if status.get("online"):
             singleMsg = f"""
             
 服务器名称：{name}
 延迟：{status.get("latency")} ms
 在线人数：{status.get("players_online")}/{status.get("players_max")}
-在线玩家：{str(status.get("players")).replace("[", "").replace("]", "").replace("'", "") if status.get("players") else "无"}
+在线玩家：{str(status.get("players")).replace("[", "").replace("]", "").replace("'", "") if status.get("players") else ("未知" if status.get("players_online") > 0 else "无")}
 当前状态：在线"""
         elif status.get("error"):
             singleMsg = f"""
@@ -440,115 +523,169 @@ def helpHandler(qid: int):
     return msg
 
 
-def bindHandler(msg: str, qid: int):
-    split = msg.split(" ")
-    if len(split) != 2:
-        return f"[CQ:at,qq={qid}] 绑定命令正确用法：/bind <name>"
-    elif not split[1].isascii():
-        return f"[CQ:at,qq={qid}] 请输入正确的游戏名称！{split[1]} 不是合法的游戏名！"
-    else:
-        try:
-            addWhitelist(split[1])
-            add_bind(qid, split[1])
-        except ServerConnectionError:
-            return f"[CQ:at,qq={qid}] 添加失败，无法连接到服务器，请重试！"
-        return f"[CQ:at,qq={qid}] 已为玩家 {split[1]} 添加白名单！"
+def checkBindReply(username: str, qid: int):
+    """检查 qq 与玩家名能否绑定，不能绑定时返回要回复的消息，否则返回 None"""
+    qq_banned, mc_banned, qq_exists, mc_exists = check_bind(qid, username)
+    if qq_banned:
+        return f"[CQ:at,qq={qid}] 你的QQ无法绑定账户，请联系管理员！"
+    if mc_banned:
+        return f"[CQ:at,qq={qid}] 此用户名无法绑定，请联系管理员！"
+    if qq_exists:
+        return f"[CQ:at,qq={qid}] 你已经拥有绑定的游戏ID了！本服务器一人一号，如有其他需要请联系管理员！"
+    if mc_exists:
+        return f"[CQ:at,qq={qid}] 此用户名 {username} 已经被绑定！请联系管理员！"
+    return None
 
 
-@app.route("/", methods=["POST"])
-def mainHander():
-    baseURL = f"http://{config.get('qq').get('host')}:{config.get('qq').get('port')}"
-    data = request.json
+def bindWhitelist(username: str, qid: int):
+    # 排队期间可能已有其他 /bind 完成，执行前再检查一次；执行器只有一个线程，这里的检查是串行的
+    msg = checkBindReply(username, qid)
+    if msg:
+        return msg
+
+    try:
+        addWhitelist(username)
+    except ServerConnectionError:
+        return f"[CQ:at,qq={qid}] 添加失败，无法连接到服务器，请重试！"
+    if not add_bind(qid, username):
+        return f"[CQ:at,qq={qid}] 已为玩家 {username} 添加白名单，但保存绑定失败，请联系管理员！"
+    return f"[CQ:at,qq={qid}] 已为玩家 {username} 添加白名单！"
+
+
+def replyWhenDone(future: Future, data: Dict, qid: int):
+    """后台任务完成后，把结果发回消息来源"""
+    try:
+        msg = future.result()
+    except Exception as e:
+        msg = f"[CQ:at,qq={qid}] 操作失败：{e}"
+    # 回调中抛出的异常只会被 concurrent.futures 记录，这里自己处理
+    try:
+        sendMessage(data, msg)
+    except httpx.HTTPError as e:
+        print(f"发送消息时出错: {e}")
+
+
+def sendMessage(data: Dict, msg: str):
+    """根据消息类型把 msg 发送到对应的群聊或私聊"""
     msgType = data.get("message_type")
-    msg = data.get("raw_message")
-    enable = True
-    qid = data.get("sender").get("user_id")
-    if data.get("raw_message") == "/status":
-        try:
-            msg = statusHandler(data.get("sender").get("user_id"))
-        except Exception as e:
-            msg = f"[CQ:at,qq={qid}] 无法获取服务器信息：{e}"
-    elif data.get("raw_message") == "/help":
-        msg = helpHandler(data.get("sender").get("user_id"))
-    elif data.get("raw_message").startswith("/bind"):
-        if len(msg.split(" ")) != 2:
-            f"[CQ:at,qq={qid}] 绑定命令正确用法：/bind <name>"
-        elif query_ban(qq=qid):
-            msg = f"[CQ:at,qq={qid}] 你的QQ无法绑定账户，请联系管理员！"
-        elif query_ban(mc=msg.split(" ")[1]):
-            msg = f"[CQ:at,qq={qid}] 此用户名无法绑定，请联系管理员！"
-        elif query_count(qq=qid):
-            msg = f"[CQ:at,qq={qid}] 你已经拥有绑定的游戏ID了！本服务器一人一号，如有其他需要请联系管理员！"
-        elif query_count(mc=msg.split(" ")[1]):
-            msg = f"[CQ:at,qq={qid}] 此用户名 {msg.split(' ')[1]} 已经被绑定！请联系管理员！"
-        else:
-            msg = bindHandler(
-                data.get("raw_message"), data.get("sender").get("user_id")
-            )
-    elif data.get("raw_message") == "/unbind":
-        if remove_bind(data.get("sender").get("user_id")):
-            username = query_username
-            try:
-                removeWhitelist(username)
-                remove_bind(mc=username)
-                msg = f"[CQ:at,qq={qid}] 已经为你解除 {username} 的绑定！"
-            except ServerConnectionError:
-                msg = f"[CQ:at,qq={qid}] 解除绑定失败，请重试！"
-        else:
-            msg = f"[CQ:at,qq={qid}] 解除绑定失败！请联系管理员！"
-    elif data.get("raw_message").startswith("/admin"):
-        commands = data.get("raw_message").split(" ")
-        if qid not in admin:
-            msg = f"[CQ:at,qq={qid}] 你不在bot管理员列表内！"
-        elif len(commands) == 1:
-            msg = f"""[CQ:at,qq={qid}] ====== 管理员命令列表 ======
+    if msgType == "group":
+        HTTP.post(
+            "/send_msg",
+            params={
+                "message_type": "group",
+                "group_id": data.get("group_id"),
+                "message": msg,
+            },
+        )
+    elif msgType == "private":
+        HTTP.post(
+            "/send_msg",
+            params={
+                "message_type": "private",
+                "user_id": data.get("sender").get("user_id"),
+                "message": msg,
+            },
+        )
+
+
+def statusCommand(data: Dict, qid: int, raw: str, parts: List[str]):
+    try:
+        return statusHandler(qid)
+    except Exception as e:
+        return f"[CQ:at,qq={qid}] 无法获取服务器信息：{e}"
+
+
+def helpCommand(data: Dict, qid: int, raw: str, parts: List[str]):
+    return helpHandler(qid)
+
+
+def bindCommand(data: Dict, qid: int, raw: str, parts: List[str]):
+    if len(parts) != 2:
+        return f"[CQ:at,qq={qid}] 绑定命令正确用法：/bind <name>"
+    if not USERNAME_RE.match(parts[1]):
+        return f"[CQ:at,qq={qid}] 请输入正确的游戏名称！{parts[1]} 不是合法的游戏名！"
+
+    msg = checkBindReply(parts[1], qid)
+    if msg:
+        return msg
+
+    # 白名单操作放到后台线程执行，完成后再单独发送结果
+    future = WHITELIST_EXECUTOR.submit(bindWhitelist, parts[1], qid)
+    future.add_done_callback(lambda f: replyWhenDone(f, data, qid))
+    return f"[CQ:at,qq={qid}] 正在为玩家 {parts[1]} 添加白名单，请稍候……"
+
+
+def unbindCommand(data: Dict, qid: int, raw: str, parts: List[str]):
+    username = query_username(qid)
+    # 没有绑定过玩家名时不需要移除白名单
+    if not username:
+        return f"[CQ:at,qq={qid}] 你还没有绑定游戏ID！"
+
+    # 先移除白名单再删除绑定，移除失败时绑定还在，用户可以直接重试
+    try:
+        removeWhitelist(username)
+    except ServerConnectionError:
+        return f"[CQ:at,qq={qid}] 解除绑定失败，请重试！"
+    if unbind_qq(qid, username) is None:
+        return f"[CQ:at,qq={qid}] 解除绑定失败！请联系管理员！"
+    return f"[CQ:at,qq={qid}] 已经为你解除 {username} 的绑定！"
+
+
+def adminCommand(data: Dict, qid: int, raw: str, parts: List[str]):
+    if qid not in admin:
+        return f"[CQ:at,qq={qid}] 你不在bot管理员列表内！"
+
+    subcommand = parts[1] if len(parts) > 1 else None
+    try:
+        if subcommand == "bind":
+            if len(parts) != 4 or not QQ_RE.match(parts[2]) or not USERNAME_RE.match(parts[3]):
+                return f"[CQ:at,qq={qid}] 管理员命令/admin bind <QQ> <name>，请正确使用！"
+            addWhitelist(parts[3])
+            force_edit_database(parts[2], parts[3])
+            return f"[CQ:at,qq={qid}] 已经为 {parts[2]} 添加了用户名 {parts[3]} 的绑定！"
+        if subcommand == "unbind":
+            if len(parts) != 3 or not USERNAME_RE.match(parts[2]):
+                return f"[CQ:at,qq={qid}] 管理员命令/admin unbind <name>，请正确使用！"
+            removeWhitelist(parts[2])
+            remove_bind(mc=parts[2])
+            return f"[CQ:at,qq={qid}] 已经清除了用户名 {parts[2]} 的绑定！"
+        if subcommand == "ban":
+            if len(parts) != 3 or not USERNAME_RE.match(parts[2]):
+                return f"[CQ:at,qq={qid}] 管理员命令/admin ban <name>，请正确使用！"
+            removeWhitelist(parts[2])
+            ban_bind(mc=parts[2])
+            return f"[CQ:at,qq={qid}] 已经封禁了用户名为 {parts[2]} 的玩家！"
+    except ServerConnectionError as e:
+        return f"[CQ:at,qq={qid}] 操作失败，无法连接到服务器：{e}"
+
+    return f"""[CQ:at,qq={qid}] ====== 管理员命令列表 ======
 ● 使用/admin bind <QQ> <name> 来为玩家强制绑定
 ● 使用/admin unbind <name> 来为玩家强制接触绑定
 ● 使用/admin ban <name> 来封禁一名玩家"""
-        elif commands[1] == "bind":
-            if len(commands) != 4 or not commands[2].isdigit() or not commands[3].isascii():
-                msg = (
-                    f"[CQ:at,qq={qid}] 管理员命令/admin bind <QQ> <name>，请正确使用！"
-                )
-            else:
-                addWhitelist(commands[3])
-                force_edit_database(commands[2], commands[3])
-                msg = f"[CQ:at,qq={qid}] 已经为 {commands[2]} 添加了用户名 {commands[3]} 的绑定！"
-        elif commands[1] == "unbind":
-            if len(commands) != 3 or not commands[2].isascii():
-                msg = f"[CQ:at,qq={qid}] 管理员命令/admin unbind <name>，请正确使用！"
-            else:
-                removeWhitelist(commands[2])
-                remove_bind(mc=commands[2])
-                msg = f"[CQ:at,qq={qid}] 已经清除了用户名 {commands[2]} 的绑定！"
-        elif commands[1] == "ban":
-            if len(commands) != 3 or not commands[2].isascii():
-                msg = f"[CQ:at,qq={qid}] 管理员命令/admin ban <name>，请正确使用！"
-            else:
-                removeWhitelist(commands[2])
-                ban_bind(mc=commands[2])
-                msg = f"[CQ:at,qq={qid}] 已经封禁了用户名为 {commands[2]} 的玩家！"
-    else:
-        enable = False
-    if enable:
-        if msgType == "group":
-            response = httpx.post(
-                baseURL + "/send_msg",
-                params={
-                    "message_type": "group",
-                    "group_id": data.get("group_id"),
-                    "message": msg,
-                },
-            )
-        elif msgType == "private":
-            response = httpx.post(
-                baseURL + "/send_msg",
-                params={
-                    "message_type": "private",
-                    "user_id": data.get("sender").get("user_id"),
-                    "message": msg,
-                },
-            )
+
+
+# 命令名 -> 处理函数，处理函数返回要回复的消息
+COMMANDS = {
+    "/status": statusCommand,
+    "/help": helpCommand,
+    "/bind": bindCommand,
+    "/unbind": unbindCommand,
+    "/admin": adminCommand,
+}
+
+
+@app.route("/", methods=["POST"])
+def mainHander():
+    data = request.json
+    # 消息内容和发送者只取一次，交给对应的命令处理函数
+    raw = data["raw_message"]
+    parts = raw.split(" ")
+    handler = COMMANDS.get(parts[0])
+    if handler is None:
+        return "success"
+
+    qid = data["sender"]["user_id"]
+    sendMessage(data, handler(data, qid, raw, parts))
     return "success"
 
 
@@ -574,8 +711,34 @@ if __name__ == "__main__":
     with open("config.yml", "r", encoding="utf-8") as file:
         config = yaml.safe_load(file)
 
+    # QQ 端地址只在启动时解析一次
+    qq = config.get("qq") or {}
+    if not qq.get("host") or not qq.get("port"):
+        print("Error: qq.host and qq.port must be set in config.yml.")
+        sys.exit(1)
+    QQ_BASE_URL = f"http://{qq['host']}:{qq['port']}"
+
     admin = config.get("admin", [])
     server = config.get("servers")
+
+    # 一个写连接 + 多个只读连接，读操作可以并发执行
+    POOL = SqlitePool(DATABASE_PATH)
     init_database(admin)
+
+    # 复用同一个 HTTP 客户端发送消息，保持与 QQ 端的长连接
+    HTTP = httpx.Client(
+        base_url=QQ_BASE_URL,
+        timeout=5.0,
+        limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+    )
+
+    # 白名单操作串行执行（客户端同一时间只能处理一条命令），不占用 Flask 的请求线程
+    WHITELIST_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+    # 常驻一个已登录的客户端，白名单命令直接写入它的 stdin
+    startMinecraftClient()
+    threading.Thread(target=watchMinecraftClient, daemon=True).start()
+
     app.register_blueprint(debugBlueprint)
-    app.run(host="0.0.0.0", port=9999, debug=True)
\ No newline at end of file
+    # 使用 waitress 多线程处理请求，查询服务器状态等阻塞操作不会互相排队
+    serve(app, host="0.0.0.0", port=9999, threads=16)
\ No newline at end of file